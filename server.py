@@ -10,64 +10,367 @@ Environment variables:
   MCP_HOST                  - Optional. Host to bind (default: "127.0.0.1" for safety).
   MCP_PORT                  - Optional. Port to bind (default: 6975).
   MCP_PATH                  - Optional. HTTP path (default: "/mcp").
+  OP_SECRET_TTL             - Optional. Seconds to cache resolved secrets; 0 disables (default: 300).
+  OP_SECRET_CACHE_SIZE      - Optional. Max cached secret references (default: 256).
+  OP_RESOLVE_TIMEOUT        - Optional. Seconds to wait on each 1Password lookup (default: 10).
+  OP_MAX_CONCURRENT         - Optional. Max concurrent 1Password lookups (default: 16).
 """
 
 import asyncio
+import functools
+import inspect
 import json
 import os
-from typing import Dict, List, Optional
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 from fastmcp import FastMCP
 from onepassword.client import Client
 
+try:
+    import orjson
+except ImportError:  # Optional speedup (pip install onepassword-mcp-server[fast]); stdlib json is used otherwise.
+    orjson = None
+
 # Configuration from environment
+_OP_TOKEN = os.getenv("OP_SERVICE_ACCOUNT_TOKEN")
 OP_VAULT = os.getenv("OP_VAULT", "AI")
 MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "streamable-http")
 MCP_HOST = os.getenv("MCP_HOST", "127.0.0.1")
 MCP_PORT = int(os.getenv("MCP_PORT", "6975"))
 MCP_PATH = os.getenv("MCP_PATH", "/mcp")
+OP_SECRET_TTL = float(os.getenv("OP_SECRET_TTL", "300"))
+OP_SECRET_CACHE_SIZE = int(os.getenv("OP_SECRET_CACHE_SIZE", "256"))
+OP_RESOLVE_TIMEOUT = float(os.getenv("OP_RESOLVE_TIMEOUT", "10"))
+OP_MAX_CONCURRENT = int(os.getenv("OP_MAX_CONCURRENT", "16"))
+
+# Default cap on captured subprocess output per pipe (bytes).
+OUTPUT_LIMIT = 1024 * 1024
+
+# Server environment snapshot used as the base for subprocess environments.
+_BASE_ENV = tuple(os.environ.items())
+
+# Vault listing is served from cache while fresh, and served stale while a
+# background refresh runs until VAULTS_STALE_TTL (seconds).
+VAULTS_FRESH_TTL = 60.0
+VAULTS_STALE_TTL = 300.0
+
+# Max buffers per writev call. sysconf is missing on Windows and may report -1
+# (no known limit), so fall back to the POSIX minimum of 16.
+try:
+    _IOV_MAX = max(os.sysconf("SC_IOV_MAX"), 16)
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
 
 # Create an MCP server
 mcp = FastMCP("1Password")
 
 # Cache the 1Password client so we don't re-authenticate on every call.
 _client: Optional[Client] = None
+# In-flight authentication shared by concurrent first callers.
+_client_future: Optional["asyncio.Future[Client]"] = None
+
+# Bounded TTL cache of resolved secrets keyed by op:// reference (LRU order).
+_secret_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+# In-flight lookup per reference, with its waiter count, so concurrent misses share
+# one SDK call and all see the same value or the same failure.
+_secret_inflight: Dict[str, List[Any]] = {}
+# Bumped by invalidate_secrets; lookups that started under an older generation
+# must not write their (possibly pre-update) values back into the cache.
+_cache_generation = 0
+_MISSING = object()
+# Caps in-flight SDK lookups so concurrent fan-out stays under 1Password rate limits.
+_resolve_semaphore = asyncio.Semaphore(OP_MAX_CONCURRENT)
+# Field that last satisfied an item's intent, keyed by (item op:// prefix, candidates),
+# so repeat lookups probe one field instead of racing every candidate.
+_field_hints: "OrderedDict[Tuple[str, Tuple[str, ...]], Tuple[float, str]]" = OrderedDict()
+
+# Stale-while-revalidate state for the vault listing resource.
+_vaults_cache: Dict[str, Any] = {"data": None, "cached_at": 0.0, "refresh": None}
+
+
+class _ClientCaps(NamedTuple):
+    """SDK entry points bound once per client, plus whether each must be awaited."""
+
+    items_list: Optional[Callable[..., Any]]
+    items_list_is_async: bool
+    items_create: Optional[Callable[..., Any]]
+    items_create_is_async: bool
+    vaults_list: Optional[Callable[..., Any]]
+    vaults_list_is_async: bool
+
+
+# Capability probes keyed by client object so injected clients are probed once too.
+_client_caps: "weakref.WeakKeyDictionary[Any, _ClientCaps]" = weakref.WeakKeyDictionary()
+
+
+@dataclass(slots=True)
+class ItemSummary:
+    """Non-secret item metadata returned by item listings."""
+
+    id: Optional[str]
+    title: Optional[str]
+    vault: Optional[str]
+    category: Optional[str]
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "title": self.title, "vault": self.vault, "category": self.category}
+
 
 # Intent to field resolution map. Ordered candidates per intent.
-INTENT_FIELD_ORDER: Dict[str, List[str]] = {
-    "password": ["password", "credential", "secret"],
-    "credential": ["password", "credential", "secret"],
-    "secret": ["secret", "token", "api_key", "key", "password"],
-    "token": ["token", "api_key", "secret", "key"],
-    "api_key": ["api_key", "token", "secret", "key"],
-    "ssh_key": ["private_key", "public_key", "passphrase", "password"],
+INTENT_FIELD_ORDER: Dict[str, Tuple[str, ...]] = {
+    "password": ("password", "credential", "secret"),
+    "credential": ("password", "credential", "secret"),
+    "secret": ("secret", "token", "api_key", "key", "password"),
+    "token": ("token", "api_key", "secret", "key"),
+    "api_key": ("api_key", "token", "secret", "key"),
+    "ssh_key": ("private_key", "public_key", "passphrase", "password"),
 }
 
 
 async def get_client() -> Client:
     """Authenticate once and reuse the 1Password client."""
-    global _client
+    global _client, _client_future
     if _client is not None:
         return _client
 
-    token = os.getenv("OP_SERVICE_ACCOUNT_TOKEN")
-    if not token:
+    if not _OP_TOKEN:
         raise RuntimeError("OP_SERVICE_ACCOUNT_TOKEN is required to talk to 1Password.")
 
-    _client = await Client.authenticate(
-        auth=token,
-        integration_name="1Password MCP Integration",
-        integration_version="v1.0.0",
-    )
+    # Concurrent first calls all await the same in-flight authentication.
+    if _client_future is None:
+        _client_future = asyncio.ensure_future(
+            Client.authenticate(
+                auth=_OP_TOKEN,
+                integration_name="1Password MCP Integration",
+                integration_version="v1.0.0",
+            )
+        )
+    future = _client_future
+    try:
+        client = await asyncio.shield(future)
+    except BaseException:
+        # Let the next caller retry instead of re-awaiting a failed attempt.
+        if _client_future is future and future.done():
+            _client_future = None
+        raise
+    _client = client
+    _caps_for(client)
     return _client
 
 
-def _field_candidates(intent: str) -> List[str]:
+def _caps_for(client: Client) -> _ClientCaps:
+    """Return the cached capability probe for client, probing on first use."""
+    caps = _client_caps.get(client)
+    if caps is None:
+        items_list = getattr(getattr(client, "items", None), "list", None)
+        items_create = getattr(getattr(client, "items", None), "create", None)
+        vaults_list = getattr(getattr(client, "vaults", None), "list", None)
+        caps = _ClientCaps(
+            items_list=items_list,
+            items_list_is_async=inspect.iscoroutinefunction(items_list),
+            items_create=items_create,
+            items_create_is_async=inspect.iscoroutinefunction(items_create),
+            vaults_list=vaults_list,
+            vaults_list_is_async=inspect.iscoroutinefunction(vaults_list),
+        )
+        _client_caps[client] = caps
+    return caps
+
+
+def _cache_get(reference: str) -> object:
+    entry = _secret_cache.get(reference)
+    if entry is None:
+        return _MISSING
+    expires_at, value = entry
+    if expires_at <= time.monotonic():
+        del _secret_cache[reference]
+        return _MISSING
+    _secret_cache.move_to_end(reference)
+    return value
+
+
+def _cache_put(reference: str, value: str) -> None:
+    _secret_cache[reference] = (time.monotonic() + OP_SECRET_TTL, value)
+    _secret_cache.move_to_end(reference)
+    while len(_secret_cache) > OP_SECRET_CACHE_SIZE:
+        _secret_cache.popitem(last=False)
+
+
+def invalidate_secrets(prefix: str) -> int:
+    """Drop cached secrets (and field hints) under prefix; returns the count of secrets removed.
+
+    Lookups already in flight finish for their current callers but are no longer
+    shared with new ones, and their results are not cached.
+    """
+    global _cache_generation
+    _cache_generation += 1
+    for reference in [reference for reference in _secret_inflight if reference.startswith(prefix)]:
+        del _secret_inflight[reference]
+    stale = [reference for reference in _secret_cache if reference.startswith(prefix)]
+    for reference in stale:
+        del _secret_cache[reference]
+    for key in [key for key in _field_hints if key[0].startswith(prefix)]:
+        del _field_hints[key]
+    return len(stale)
+
+
+def _hinted_field(item_prefix: str, candidates: Tuple[str, ...]) -> Optional[str]:
+    """Return the field that last satisfied these candidates for the item, if still fresh."""
+    entry = _field_hints.get((item_prefix, candidates))
+    if entry is None:
+        return None
+    expires_at, field_name = entry
+    if expires_at <= time.monotonic():
+        del _field_hints[(item_prefix, candidates)]
+        return None
+    _field_hints.move_to_end((item_prefix, candidates))
+    return field_name
+
+
+def _remember_field(item_prefix: str, candidates: Tuple[str, ...], field_name: str) -> None:
+    if OP_SECRET_TTL <= 0:
+        return
+    _field_hints[(item_prefix, candidates)] = (time.monotonic() + OP_SECRET_TTL, field_name)
+    _field_hints.move_to_end((item_prefix, candidates))
+    while len(_field_hints) > OP_SECRET_CACHE_SIZE:
+        _field_hints.popitem(last=False)
+
+
+async def _sdk_resolve(client: Client, reference: str) -> str:
+    """Call the SDK for one reference, bounded by the concurrency cap and OP_RESOLVE_TIMEOUT."""
+    async with _resolve_semaphore:
+        return await asyncio.wait_for(client.secrets.resolve(reference), timeout=OP_RESOLVE_TIMEOUT)
+
+
+async def _resolve_reference(client: Client, reference: str) -> str:
+    """Resolve an op:// reference, serving repeat reads from the TTL cache."""
+    if OP_SECRET_TTL <= 0:
+        return await _sdk_resolve(client, reference)
+
+    value = _cache_get(reference)
+    if value is not _MISSING:
+        return value  # type: ignore[return-value]
+
+    entry = _secret_inflight.get(reference)
+    if entry is None:
+        entry = _secret_inflight[reference] = [
+            asyncio.ensure_future(_fetch_secret(client, reference, _cache_generation)),
+            0,
+        ]
+    task = entry[0]
+    entry[1] += 1
+    try:
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            if _secret_inflight.get(reference) is entry:
+                del _secret_inflight[reference]
+            # Every waiter gave up (e.g. lost a candidate race); stop the SDK call too.
+            task.cancel()
+
+
+async def _fetch_secret(client: Client, reference: str, generation: int) -> str:
+    value = await _sdk_resolve(client, reference)
+    if generation == _cache_generation:
+        _cache_put(reference, value)
+    return value
+
+
+async def _first_resolved(client: Client, references: Sequence[str]) -> Tuple[int, str]:
+    """Race references concurrently and return (index, value) of the first success in list order.
+
+    Lower-priority lookups are cancelled as soon as a higher-priority one succeeds.
+    Raises the last failure if no reference resolves.
+    """
+    # A cached reference settles the race for everything ranked below it, so only
+    # higher-priority references need an SDK call.
+    cached: Optional[Tuple[int, str]] = None
+    if OP_SECRET_TTL > 0:
+        for index, reference in enumerate(references):
+            value = _cache_get(reference)
+            if value is not _MISSING:
+                cached = index, value  # type: ignore[assignment]
+                references = references[:index]
+                break
+        if cached is not None and not references:
+            return cached
+
+    tasks = [asyncio.ensure_future(_resolve_reference(client, reference)) for reference in references]
+    pending = set(tasks)
+    next_index = 0
+    last_error: Optional[BaseException] = None
+    try:
+        while True:
+            # Settle candidates in priority order as far as completed tasks allow.
+            while next_index < len(tasks) and tasks[next_index].done():
+                error = tasks[next_index].exception()
+                if error is None:
+                    return next_index, tasks[next_index].result()
+                last_error = error
+                next_index += 1
+            if next_index == len(tasks):
+                if cached is not None:
+                    return cached
+                break
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # Mark losing failures as retrieved.
+    raise last_error or LookupError("No secret references to resolve.")
+
+
+@functools.lru_cache(maxsize=64)
+def _field_candidates(intent: str) -> Tuple[str, ...]:
     normalized = intent.lower().strip()
     if normalized in INTENT_FIELD_ORDER:
         return INTENT_FIELD_ORDER[normalized]
     # Fallback to intent name itself if not mapped.
-    return [normalized]
+    return (normalized,)
+
+
+@functools.lru_cache(maxsize=256)
+def _item_references(
+    vault_name: str, item_name: str, candidates: Tuple[str, ...]
+) -> Tuple[str, Tuple[str, ...]]:
+    """Return an item's op:// prefix and its candidate references, memoized per vault/item/intent."""
+    prefix = f"op://{vault_name}/{item_name}/"
+    return prefix, tuple(prefix + field_name for field_name in candidates)
+
+
+def _unresolved_error(item_name: str, vault_name: str, intent: str, candidates: Tuple[str, ...]) -> RuntimeError:
+    return RuntimeError(
+        f"Unable to resolve any fields for item '{item_name}' in vault '{vault_name}' "
+        f"with intent '{intent}'. Tried: {', '.join(candidates)}"
+    )
+
+
+async def _resolve_untried(
+    client: Client,
+    item_name: str,
+    vault_name: str,
+    intent: str,
+    tried: Tuple[str, ...] = (),
+) -> Tuple[str, str]:
+    """Race the intent's candidate fields not in tried; returns (field, value) and remembers the winner."""
+    candidates = _field_candidates(intent)
+    prefix, references = _item_references(vault_name, item_name, candidates)
+    remaining = [index for index, field_name in enumerate(candidates) if field_name not in tried]
+    try:
+        position, value = await _first_resolved(client, [references[index] for index in remaining])
+    except Exception as exc:  # noqa: BLE001
+        # If we exhausted candidates, surface a clear error.
+        raise _unresolved_error(item_name, vault_name, intent, candidates) from exc
+    field_name = candidates[remaining[position]]
+    _remember_field(prefix, candidates, field_name)
+    return field_name, value
 
 
 async def resolve_secret_impl(
@@ -79,36 +382,36 @@ async def resolve_secret_impl(
     """Resolve a secret/credential from 1Password with intent-based field selection."""
     client = client or await get_client()
     vault_name = vault or OP_VAULT
+    kind = intent.lower()
 
     candidates = _field_candidates(intent)
-    last_error: Optional[Exception] = None
+    if not candidates:
+        # This covers the case where no candidates are available (unexpected intent).
+        raise RuntimeError(
+            f"No field candidates available for intent '{intent}'. "
+            "Provide an explicit field name or use a supported intent."
+        )
 
-    for field_name in candidates:
+    prefix, _ = _item_references(vault_name, item_name, candidates)
+    field_name = _hinted_field(prefix, candidates)
+    tried: Tuple[str, ...] = ()
+    if field_name is not None:
         try:
-            value = await client.secrets.resolve(f"op://{vault_name}/{item_name}/{field_name}")
-            return {
-                "item": item_name,
-                "vault": vault_name,
-                "field": field_name,
-                "kind": intent.lower(),
-                "value": value,
-            }
-        except Exception as exc:  # noqa: BLE001
-            last_error = exc
-            continue
+            value = await _resolve_reference(client, prefix + field_name)
+        except Exception:  # noqa: BLE001
+            # The item changed since the hint was recorded; race the other candidates.
+            tried, field_name = (field_name,), None
 
-    # If we exhausted candidates, surface a clear error.
-    if last_error:
-        raise RuntimeError(
-            f"Unable to resolve any fields for item '{item_name}' in vault '{vault_name}' "
-            f"with intent '{intent}'. Tried: {', '.join(candidates)}"
-        ) from last_error
-
-    # This covers the case where no candidates are available (unexpected intent).
-    raise RuntimeError(
-        f"No field candidates available for intent '{intent}'. "
-        "Provide an explicit field name or use a supported intent."
-    )
+    if field_name is None:
+        field_name, value = await _resolve_untried(client, item_name, vault_name, intent, tried)
+
+    return {
+        "item": item_name,
+        "vault": vault_name,
+        "field": field_name,
+        "kind": kind,
+        "value": value,
+    }
 
 
 @mcp.tool()
@@ -137,17 +440,15 @@ async def health_resource() -> dict:
     }
 
 
-@mcp.resource("onepassword://vaults")
-async def vaults_resource() -> List[dict]:
-    """List available vaults without exposing secrets."""
-    client = await get_client()
-    vaults_api = getattr(client, "vaults", None)
-    if vaults_api is None or not hasattr(vaults_api, "list"):
+async def _refresh_vaults() -> List[dict]:
+    """Fetch the vault list from 1Password and store it in the stale-while-revalidate cache."""
+    caps = _caps_for(await get_client())
+    if caps.vaults_list is None:
         raise RuntimeError("Vault listing is not supported by the installed onepassword-sdk version.")
 
-    results = vaults_api.list()
-    if hasattr(results, "__await__"):
-        results = await results  # type: ignore[assignment]
+    results = caps.vaults_list()
+    if caps.vaults_list_is_async:
+        results = await results
 
     summaries = []
     for vault in results or []:
@@ -157,19 +458,46 @@ async def vaults_resource() -> List[dict]:
                 "name": getattr(vault, "name", None),
             }
         )
+    _vaults_cache["data"] = summaries
+    _vaults_cache["cached_at"] = time.monotonic()
     return summaries
 
 
+def _finish_vaults_refresh(task: "asyncio.Task[List[dict]]") -> None:
+    _vaults_cache["refresh"] = None
+    if not task.cancelled():
+        task.exception()  # A failed background refresh keeps serving stale data.
+
+
+@mcp.resource("onepassword://vaults")
+async def vaults_resource() -> List[dict]:
+    """List available vaults without exposing secrets."""
+    data = _vaults_cache["data"]
+    age = time.monotonic() - _vaults_cache["cached_at"]
+    if data is not None and age < VAULTS_FRESH_TTL:
+        return data
+
+    # One refresh at a time; concurrent readers share it.
+    refresh = _vaults_cache["refresh"]
+    if refresh is None:
+        refresh = asyncio.ensure_future(_refresh_vaults())
+        refresh.add_done_callback(_finish_vaults_refresh)
+        _vaults_cache["refresh"] = refresh
+
+    if data is not None and age < VAULTS_STALE_TTL:
+        return data
+    return await asyncio.shield(refresh)
+
+
 async def list_items_impl(
     query: Optional[str] = None,
     vault: Optional[str] = None,
     category: Optional[str] = None,
     client: Optional[Client] = None,
-) -> List[dict]:
+) -> List[ItemSummary]:
     """List items (optionally filtered) to aid discovery and disambiguation."""
-    client = client or await get_client()
-    items_api = getattr(client, "items", None)
-    if items_api is None:
+    caps = _caps_for(client or await get_client())
+    if caps.items_list is None:
         raise RuntimeError("Item listing is not supported by the installed onepassword-sdk version.")
 
     kwargs: Dict[str, str] = {}
@@ -181,22 +509,19 @@ async def list_items_impl(
         kwargs["category"] = category
 
     # The SDK may be synchronous or async; handle both.
-    results = items_api.list(**kwargs)  # type: ignore[arg-type]
-    if hasattr(results, "__await__"):
-        results = await results  # type: ignore[assignment]
-
-    summaries = []
-    for item in results or []:
-        summaries.append(
-            {
-                "id": getattr(item, "id", None),
-                "title": getattr(item, "title", None) or getattr(item, "name", None),
-                "vault": getattr(getattr(item, "vault", None), "name", None)
-                or getattr(item, "vault", None),
-                "category": getattr(item, "category", None),
-            }
+    results = caps.items_list(**kwargs)
+    if caps.items_list_is_async:
+        results = await results
+
+    return [
+        ItemSummary(
+            id=getattr(item, "id", None),
+            title=getattr(item, "title", None) or getattr(item, "name", None),
+            vault=getattr(getattr(item, "vault", None), "name", None) or getattr(item, "vault", None),
+            category=getattr(item, "category", None),
         )
-    return summaries
+        for item in results or []
+    ]
 
 
 @mcp.tool()
@@ -204,7 +529,7 @@ async def list_items(
     query: Optional[str] = None,
     vault: Optional[str] = None,
     category: Optional[str] = None,
-) -> List[dict]:
+) -> List[ItemSummary]:
     """List items (optionally filtered) to aid discovery and disambiguation."""
     return await list_items_impl(query=query, vault=vault, category=category)
 
@@ -212,7 +537,47 @@ async def list_items(
 @mcp.resource("onepassword://vaults/{vault}/items")
 async def vault_items_resource(vault: str) -> List[dict]:
     """List items for a given vault without exposing secret values."""
-    return await list_items_impl(vault=vault)
+    return [summary.to_dict() for summary in await list_items_impl(vault=vault)]
+
+
+def _build_password_fields(fields: Dict[str, str]) -> List[dict]:
+    return [
+        {
+            "id": "username",
+            "label": "username",
+            "value": fields.get("username", fields.get("user", "")),
+            "purpose": "USERNAME",
+        },
+        {"id": "password", "label": "password", "value": fields.get("password", ""), "purpose": "PASSWORD"},
+    ]
+
+
+def _build_api_key_fields(fields: Dict[str, str]) -> List[dict]:
+    return [
+        {"id": "api_key", "label": "api_key", "value": fields.get("api_key") or fields.get("token") or fields.get("secret")},
+    ]
+
+
+def _build_ssh_key_fields(fields: Dict[str, str]) -> List[dict]:
+    return [
+        {"id": "private_key", "label": "private_key", "value": fields.get("private_key")},
+        {"id": "public_key", "label": "public_key", "value": fields.get("public_key")},
+        {"id": "passphrase", "label": "passphrase", "value": fields.get("passphrase")},
+    ]
+
+
+def _build_generic_fields(fields: Dict[str, str]) -> List[dict]:
+    return [{"id": k, "label": k, "value": v} for k, v in fields.items()]
+
+
+# Item kind to field template builder; unknown kinds store fields verbatim.
+_FIELD_BUILDERS: Dict[str, Callable[[Dict[str, str]], List[dict]]] = {
+    "password": _build_password_fields,
+    "api_key": _build_api_key_fields,
+    "token": _build_api_key_fields,
+    "secret": _build_api_key_fields,
+    "ssh_key": _build_ssh_key_fields,
+}
 
 
 async def upsert_item_impl(
@@ -224,9 +589,8 @@ async def upsert_item_impl(
     client: Optional[Client] = None,
 ) -> dict:
     """Create or update an item with templated kinds (password, api_key, ssh_key)."""
-    client = client or await get_client()
-    items_api = getattr(client, "items", None)
-    if items_api is None or not hasattr(items_api, "create"):
+    caps = _caps_for(client or await get_client())
+    if caps.items_create is None:
         raise RuntimeError("Item creation is not supported by the installed onepassword-sdk version.")
 
     vault_name = vault or OP_VAULT
@@ -239,34 +603,17 @@ async def upsert_item_impl(
         "vault": {"name": vault_name},
         "category": "LOGIN" if normalized_kind == "password" else "SECURE_NOTE",
         "tags": tags,
-        "fields": [],
+        # Apply sensible defaults for common kinds.
+        "fields": _FIELD_BUILDERS.get(normalized_kind, _build_generic_fields)(fields),
     }
 
-    # Apply sensible defaults for common kinds.
-    if normalized_kind == "password":
-        username = fields.get("username", fields.get("user", ""))
-        password = fields.get("password", "")
-        payload["fields"] = [
-            {"id": "username", "label": "username", "value": username, "purpose": "USERNAME"},
-            {"id": "password", "label": "password", "value": password, "purpose": "PASSWORD"},
-        ]
-    elif normalized_kind in ("api_key", "token", "secret"):
-        payload["fields"] = [
-            {"id": "api_key", "label": "api_key", "value": fields.get("api_key") or fields.get("token") or fields.get("secret")},
-        ]
-    elif normalized_kind == "ssh_key":
-        payload["fields"] = [
-            {"id": "private_key", "label": "private_key", "value": fields.get("private_key")},
-            {"id": "public_key", "label": "public_key", "value": fields.get("public_key")},
-            {"id": "passphrase", "label": "passphrase", "value": fields.get("passphrase")},
-        ]
-    else:
-        payload["fields"] = [{"id": k, "label": k, "value": v} for k, v in fields.items()]
-
     # Call create/update; prefer update if an ID is present.
-    result = items_api.create(payload)  # type: ignore[arg-type]
-    if hasattr(result, "__await__"):
-        result = await result  # type: ignore[assignment]
+    result = caps.items_create(payload)
+    if caps.items_create_is_async:
+        result = await result
+
+    # Write-through: never serve the previous values of this item from cache.
+    invalidate_secrets(f"op://{vault_name}/{name}/")
 
     return {
         "name": name,
@@ -297,45 +644,173 @@ async def upsert_item(
     )
 
 
+async def _batched_resolve(client: Client, references: List[str]) -> List[object]:
+    """Resolve many op:// references, in one SDK call when the SDK supports it.
+
+    Returns values in reference order; references that failed come back as exceptions.
+    """
+    outcomes: List[object] = [_cache_get(reference) if OP_SECRET_TTL > 0 else _MISSING for reference in references]
+    misses = [index for index, outcome in enumerate(outcomes) if outcome is _MISSING]
+    if not misses:
+        return outcomes
+
+    resolve_all = getattr(client.secrets, "resolve_all", None)
+    generation = _cache_generation
+    response = None
+    if resolve_all is not None:
+        try:
+            async with _resolve_semaphore:
+                response = await asyncio.wait_for(
+                    resolve_all(list(dict.fromkeys(references[index] for index in misses))),
+                    timeout=OP_RESOLVE_TIMEOUT,
+                )
+        except Exception:  # noqa: BLE001
+            # The batch failed as a whole (timeout, transport error); resolve each
+            # reference on its own so every outcome reflects that reference alone.
+            response = None
+    if response is None:
+        fetched = await asyncio.gather(
+            *(_resolve_reference(client, references[index]) for index in misses),
+            return_exceptions=True,
+        )
+        for index, outcome in zip(misses, fetched):
+            outcomes[index] = outcome
+        return outcomes
+
+    for index in misses:
+        reference = references[index]
+        individual = response.individual_responses.get(reference)
+        if individual is None or individual.content is None:
+            error = getattr(getattr(individual, "error", None), "type", "missing response")
+            outcomes[index] = LookupError(f"Unable to resolve {reference}: {error}")
+            continue
+        outcomes[index] = individual.content.secret
+        if OP_SECRET_TTL > 0 and generation == _cache_generation:
+            _cache_put(reference, individual.content.secret)
+    return outcomes
+
+
+async def _resolve_secret_specs(
+    secrets: List[Dict[str, str]],
+    vault_name: str,
+    client: Client,
+) -> List[str]:
+    """Resolve a list of secret specs, preserving spec order.
+
+    All lookups go out in a single batch: a spec's remembered field if known,
+    otherwise every candidate field when the SDK can batch, or just the
+    preferred field when it cannot. Specs the batch could not satisfy race
+    only the candidate fields it did not already try.
+    """
+    batch_all_candidates = getattr(client.secrets, "resolve_all", None) is not None
+    intents = [spec.get("intent", "password") for spec in secrets]
+    references: List[str] = []
+    # Per spec: (item prefix, candidates, offset into references, fields tried).
+    plans: List[Tuple[str, Tuple[str, ...], int, Tuple[str, ...]]] = []
+    for spec, intent in zip(secrets, intents):
+        candidates = _field_candidates(intent)
+        prefix, candidate_references = _item_references(vault_name, spec["item"], candidates)
+        hinted = _hinted_field(prefix, candidates)
+        if hinted is not None:
+            fields: Tuple[str, ...] = (hinted,)
+            references.append(prefix + hinted)
+        elif batch_all_candidates:
+            fields = candidates
+            references.extend(candidate_references)
+        else:
+            fields = candidates[:1]
+            references.append(candidate_references[0])
+        plans.append((prefix, candidates, len(references) - len(fields), fields))
+    outcomes = await _batched_resolve(client, references)
+
+    values: List[object] = []
+    retry: List[Tuple[int, Tuple[str, ...]]] = []
+    for index, (prefix, candidates, offset, fields) in enumerate(plans):
+        for position, field_name in enumerate(fields):
+            outcome = outcomes[offset + position]
+            if not isinstance(outcome, BaseException):
+                values.append(outcome)
+                _remember_field(prefix, candidates, field_name)
+                break
+        else:
+            if len(fields) == len(candidates):
+                # The batch already tried every candidate; retrying them one by one cannot help.
+                raise _unresolved_error(
+                    secrets[index]["item"], vault_name, intents[index], candidates
+                ) from outcomes[offset + len(fields) - 1]
+            values.append(None)
+            retry.append((index, fields))
+
+    fallbacks = await asyncio.gather(
+        *(
+            _resolve_untried(client, secrets[index]["item"], vault_name, intents[index], tried)
+            for index, tried in retry
+        )
+    )
+    for (index, _), (_, value) in zip(retry, fallbacks):
+        values[index] = value
+    return values  # type: ignore[return-value]
+
+
+async def _drain(stream: asyncio.StreamReader, buffer: bytearray, limit: int) -> bool:
+    """Read a pipe to EOF keeping at most limit bytes; returns True if output was truncated."""
+    truncated = False
+    while chunk := await stream.read(65536):
+        room = limit - len(buffer)
+        if room > 0:
+            buffer += chunk[:room]
+        if len(chunk) > room:
+            truncated = True
+    return truncated
+
+
 async def run_with_secrets_impl(
     command: List[str],
     secrets: List[Dict[str, str]],
     vault: Optional[str] = None,
     working_dir: Optional[str] = None,
-    timeout: Optional[int] = 30,
+    timeout: Optional[float] = 30,
+    stdout_limit: int = OUTPUT_LIMIT,
+    stderr_limit: int = OUTPUT_LIMIT,
     client: Optional[Client] = None,
+    runner: Optional[Callable[..., Awaitable[asyncio.subprocess.Process]]] = None,
 ) -> dict:
     """Run a command with secrets injected as environment variables.
 
     Secrets are never printed or logged - they exist only in subprocess memory.
+    Output is streamed and capped at stdout_limit/stderr_limit bytes per pipe.
     """
     client = client or await get_client()
     vault_name = vault or OP_VAULT
 
     # Build environment with secrets
-    env = os.environ.copy()
+    env = dict(_BASE_ENV)
     injected_keys = []
-    for spec in secrets:
-        result = await resolve_secret_impl(
-            item_name=spec["item"],
-            intent=spec.get("intent", "password"),
-            vault=vault_name,
-            client=client,
-        )
+    for spec, value in zip(secrets, await _resolve_secret_specs(secrets, vault_name, client)):
         env_key = spec["env"]
-        env[env_key] = result["value"]
+        env[env_key] = value
         injected_keys.append(env_key)
 
     # Run subprocess without shell (prevents injection attacks)
-    proc = await asyncio.create_subprocess_exec(
+    runner = runner or asyncio.create_subprocess_exec
+    proc = await runner(
         *command,
         env=env,
         cwd=working_dir,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
     )
+    stdout = bytearray()
+    stderr = bytearray()
     try:
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        stdout_truncated, stderr_truncated, _ = await asyncio.wait_for(
+            asyncio.gather(
+                _drain(proc.stdout, stdout, stdout_limit),
+                _drain(proc.stderr, stderr, stderr_limit),
+                proc.wait(),
+            ),
+            timeout=timeout,
+        )
     except asyncio.TimeoutError:
         proc.kill()
         await proc.wait()
@@ -347,12 +822,17 @@ async def run_with_secrets_impl(
             "timed_out": True,
         }
 
-    return {
+    result = {
         "exit_code": proc.returncode,
-        "stdout": stdout.decode(),
-        "stderr": stderr.decode(),
+        "stdout": stdout.decode(errors="replace"),
+        "stderr": stderr.decode(errors="replace"),
         "secrets_injected": injected_keys,
     }
+    if stdout_truncated:
+        result["stdout_truncated"] = True
+    if stderr_truncated:
+        result["stderr_truncated"] = True
+    return result
 
 
 @mcp.tool()
@@ -361,7 +841,9 @@ async def run_with_secrets(
     secrets: List[Dict[str, str]],
     vault: Optional[str] = None,
     working_dir: Optional[str] = None,
-    timeout: Optional[int] = 30,
+    timeout: Optional[float] = 30,
+    stdout_limit: int = OUTPUT_LIMIT,
+    stderr_limit: int = OUTPUT_LIMIT,
 ) -> dict:
     """Run a command with secrets injected as environment variables.
 
@@ -375,9 +857,12 @@ async def run_with_secrets(
         vault: Optional vault name (defaults to OP_VAULT)
         working_dir: Optional working directory for the subprocess
         timeout: Timeout in seconds (default 30)
+        stdout_limit: Max bytes of stdout to capture (default 1 MiB)
+        stderr_limit: Max bytes of stderr to capture (default 1 MiB)
 
     Returns:
-        Dict with exit_code, stdout, stderr, and secrets_injected (env var names only)
+        Dict with exit_code, stdout, stderr, and secrets_injected (env var names only);
+        stdout_truncated/stderr_truncated are set when output exceeded its limit
     """
     return await run_with_secrets_impl(
         command=command,
@@ -385,9 +870,35 @@ async def run_with_secrets(
         vault=vault,
         working_dir=working_dir,
         timeout=timeout,
+        stdout_limit=stdout_limit,
+        stderr_limit=stderr_limit,
     )
 
 
+# Escapes for values written inside double quotes. dotenv parsers decode backslash
+# escapes; POSIX shells (export format) also expand $ and backticks.
+_DOTENV_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"})
+_EXPORT_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "$": "\\$", "`": "\\`"})
+
+
+def _write_all(fd: int, parts: List[bytes]) -> None:
+    """Write every chunk to fd with gathered writes, resuming after short writes."""
+    if getattr(os, "writev", None) is None:
+        # Windows: no gathered writes, so join once and loop on os.write.
+        data = memoryview(b"".join(parts))
+        while data:
+            data = data[os.write(fd, data) :]
+        return
+    start = 0
+    while start < len(parts):
+        written = os.writev(fd, parts[start : start + _IOV_MAX])
+        while start < len(parts) and written >= len(parts[start]):
+            written -= len(parts[start])
+            start += 1
+        if written:
+            parts[start] = parts[start][written:]
+
+
 async def write_env_file_impl(
     path: str,
     secrets: List[Dict[str, str]],
@@ -405,22 +916,20 @@ async def write_env_file_impl(
 
     # Resolve all secrets first
     resolved = {}
-    for spec in secrets:
-        result = await resolve_secret_impl(
-            item_name=spec["item"],
-            intent=spec.get("intent", "password"),
-            vault=vault_name,
-            client=client,
-        )
-        resolved[spec["key"]] = result["value"]
-
-    # Format content
-    if format == "dotenv":
-        content = "\n".join(f'{k}="{v}"' for k, v in resolved.items())
-    elif format == "export":
-        content = "\n".join(f'export {k}="{v}"' for k, v in resolved.items())
+    for spec, value in zip(secrets, await _resolve_secret_specs(secrets, vault_name, client)):
+        resolved[spec["key"]] = value
+
+    # Format content as a list of byte chunks; the kernel gathers them in writev.
+    parts: List[bytes] = []
+    if format in ("dotenv", "export"):
+        line_prefix, escapes = (b"export ", _EXPORT_ESCAPES) if format == "export" else (b"", _DOTENV_ESCAPES)
+        for k, v in resolved.items():
+            parts.extend((line_prefix, k.encode(), b'="', v.translate(escapes).encode(), b'"\n'))
     elif format == "json":
-        content = json.dumps(resolved, indent=2)
+        if orjson is not None:
+            parts.append(orjson.dumps(resolved))
+        else:
+            parts.append(json.dumps(resolved, separators=(",", ":")).encode())
     else:
         raise ValueError(f"Unknown format: {format}. Supported: dotenv, export, json")
 
@@ -428,7 +937,7 @@ async def write_env_file_impl(
     # O_EXCL ensures we don't overwrite existing files (security)
     fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
     try:
-        os.write(fd, content.encode())
+        _write_all(fd, parts)
     finally:
         os.close(fd)
 
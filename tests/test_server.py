@@ -1,34 +1,56 @@
+import asyncio
 import os
 import stat
 import tempfile
 import unittest
+from collections import namedtuple
+from types import SimpleNamespace
+from unittest import mock
 
 import server
 
+try:
+    import uvloop
+except ImportError:  # Optional; POSIX-only.
+    pass
+else:
+    # IsolatedAsyncioTestCase builds a fresh loop per test; uvloop makes that loop cheaper.
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+_Vault = namedtuple("_Vault", ["name"])
+_Result = namedtuple("_Result", ["id"])
+
 
 class FakeSecrets:
     def __init__(self, values):
         self.values = values
+        self.calls = []  # Every path passed to resolve, in call order.
+        self.delays = {}  # Field name -> seconds to sleep before answering.
 
     async def resolve(self, path: str):
+        self.calls.append(path)
         # Path shape: op://{vault}/{item}/{field}
-        parts = path.split("/")
-        try:
-            _, vault, item, field = parts[0].rstrip(":"), parts[2], parts[3], parts[4]
-        except IndexError:
-            raise KeyError(f"Invalid path format: {path}") from None
+        parts = path[5:].split("/", 2) if path.startswith("op://") else ()
+        if len(parts) != 3 or "/" in parts[2]:
+            raise KeyError(f"Invalid path format: {path}")
+        vault, item, field = parts
+        if field in self.delays:
+            await asyncio.sleep(self.delays[field])
 
-        key = (vault, item, field)
-        if key not in self.values:
-            raise KeyError(f"Missing secret for {key}")
-        return self.values[key]
+        try:
+            return self.values[(vault, item, field)]
+        except KeyError:
+            raise KeyError(f"Missing secret for {(vault, item, field)}") from None
 
 
 class FakeItem:
+    __slots__ = ("id", "title", "_title_lower", "vault", "category")
+
     def __init__(self, item_id, title, vault, category):
         self.id = item_id
         self.title = title
-        self.vault = type("Vault", (), {"name": vault})
+        self._title_lower = (title or "").lower()
+        self.vault = _Vault(vault)
         self.category = category
 
 
@@ -42,18 +64,59 @@ class FakeItems:
         vault = kwargs.get("vault")
         category = kwargs.get("category")
 
-        results = self.items
-        if query:
-            results = [i for i in results if query.lower() in (i.title or "").lower()]
-        if vault:
-            results = [i for i in results if getattr(i.vault, "name", None) == vault]
-        if category:
-            results = [i for i in results if i.category == category]
-        return results
+        q = query.lower() if query else None
+        # Cheapest predicates first; titles are lowercased once at construction.
+        return [
+            i
+            for i in self.items
+            if (not category or i.category == category)
+            and (not vault or i.vault.name == vault)
+            and (q is None or q in i._title_lower)
+        ]
 
     def create(self, payload):
         self.created_payload = payload
-        return type("Result", (), {"id": "new-item-id"})
+        return _Result("new-item-id")
+
+
+class FakeProcess:
+    """Stand-in for asyncio.subprocess.Process with canned output."""
+
+    def __init__(self, stdout=b"", stderr=b"", returncode=0, runtime=0.0):
+        self.stdout = asyncio.StreamReader()
+        self.stdout.feed_data(stdout)
+        self.stdout.feed_eof()
+        self.stderr = asyncio.StreamReader()
+        self.stderr.feed_data(stderr)
+        self.stderr.feed_eof()
+        self.returncode = None
+        self.killed = False
+        self._exit_code = returncode
+        self._runtime = runtime
+
+    async def wait(self):
+        if self.returncode is None:
+            await asyncio.sleep(self._runtime)
+            self.returncode = self._exit_code
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+        self.returncode = -9
+
+
+def fake_runner(output=None, **process_kwargs):
+    """Build a runner that records its calls; output(env) returns the fake stdout bytes."""
+    calls = []
+
+    async def runner(*command, env=None, cwd=None, stdout=None, stderr=None):
+        calls.append({"command": list(command), "env": env, "cwd": cwd})
+        process = FakeProcess(stdout=output(env) if output else b"", **process_kwargs)
+        runner.process = process
+        return process
+
+    runner.calls = calls
+    return runner
 
 
 class FakeClient:
@@ -63,18 +126,58 @@ class FakeClient:
 
 
 class ServerTests(unittest.IsolatedAsyncioTestCase):
-    async def asyncSetUp(self):
-        secrets = {
+    @classmethod
+    def setUpClass(cls):
+        # One scratch directory for the class; each test writes a uniquely named file.
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        cls.tmpdir = tmp.name
+
+        # Fixture data is built once; each test gets shallow copies it may mutate.
+        cls._secrets = {
             ("AI", "netbox", "password"): "netbox-pass",
             ("AI", "netbox", "secret"): "netbox-secret",
             ("Vault2", "api", "api_key"): "api-token-123",
+            ("AI", "tricky", "password"): 'pa"ss $HOME `id` \\ end',
+            ("AI", "multiline", "password"): 'line1\r\n"quoted" \\ end',
         }
-        items = [
+        cls._items_template = [
             FakeItem("1", "NetBox", "AI", "LOGIN"),
             FakeItem("2", "API Token", "Vault2", "SECURE_NOTE"),
         ]
-        self.fake_client = FakeClient(secrets, items)
-        server._client = self.fake_client  # Reuse cached client
+
+        # Calls that fall back to get_client() share one cached client for the whole class.
+        cls.enterClassContext(
+            mock.patch.object(server, "_client", FakeClient(dict(cls._secrets), list(cls._items_template)))
+        )
+
+    async def asyncSetUp(self):
+        self.fake_client = FakeClient(dict(self._secrets), list(self._items_template))
+        server._client_future = None
+        server._vaults_cache.update(data=None, cached_at=0.0, refresh=None)
+        server._secret_cache.clear()
+        server._field_hints.clear()
+
+    async def test_get_client_authenticates_once_under_concurrency(self):
+        calls = []
+
+        async def authenticate(**kwargs):
+            calls.append(kwargs)
+            await asyncio.sleep(0.01)
+            return self.fake_client
+
+        with mock.patch.object(server, "_client", None), mock.patch.object(
+            server, "_OP_TOKEN", "test-token"
+        ), mock.patch.object(server.Client, "authenticate", new=authenticate):
+            clients = await asyncio.gather(*(server.get_client() for _ in range(5)))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(client is self.fake_client for client in clients))
+
+    async def test_get_client_requires_token(self):
+        with mock.patch.object(server, "_client", None), mock.patch.object(server, "_OP_TOKEN", None):
+            with self.assertRaises(RuntimeError) as ctx:
+                await server.get_client()
+        self.assertIn("OP_SERVICE_ACCOUNT_TOKEN", str(ctx.exception))
 
     async def test_resolve_secret_prefers_password(self):
         result = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
@@ -86,16 +189,192 @@ class ServerTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result["field"], "secret")
         self.assertEqual(result["value"], "netbox-secret")
 
+    async def test_resolve_secret_keeps_priority_when_fallback_is_faster(self):
+        self.fake_client.secrets.delays["password"] = 0.05
+        result = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(result["field"], "password")
+        self.assertEqual(result["value"], "netbox-pass")
+
+    async def test_resolve_secret_times_out_hung_field(self):
+        self.fake_client.secrets.delays["password"] = 60
+        with mock.patch.object(server, "OP_RESOLVE_TIMEOUT", 0.05):
+            result = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(result["field"], "secret")
+
+    async def test_resolve_secret_shares_failing_lookup_between_callers(self):
+        self.fake_client.secrets.delays["password"] = 60
+        with mock.patch.object(server, "OP_RESOLVE_TIMEOUT", 0.05):
+            results = await asyncio.gather(
+                *(
+                    server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+                    for _ in range(4)
+                )
+            )
+        self.assertEqual({result["field"] for result in results}, {"secret"})
+        # Callers wait on one shared (timed out) lookup instead of queueing one each.
+        self.assertEqual(self.fake_client.secrets.calls.count("op://AI/netbox/password"), 1)
+
+    async def test_resolve_secret_probes_remembered_field_first(self):
+        first = await server.resolve_secret_impl("netbox", intent="token", vault="AI", client=self.fake_client)
+        self.assertEqual(first["field"], "secret")
+
+        server._secret_cache.clear()
+        self.fake_client.secrets.calls.clear()
+        second = await server.resolve_secret_impl("netbox", intent="token", vault="AI", client=self.fake_client)
+        self.assertEqual(second["value"], "netbox-secret")
+        self.assertEqual(self.fake_client.secrets.calls, ["op://AI/netbox/secret"])
+
+    async def test_resolve_secret_skips_lookups_below_cached_field(self):
+        server._cache_put("op://AI/netbox/password", "cached-pass")
+        result = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(result["value"], "cached-pass")
+        self.assertEqual(self.fake_client.secrets.calls, [])
+
+        # A cached lower-priority field still lets higher-priority fields win, but nothing below it is sent.
+        server._secret_cache.clear()
+        server._field_hints.clear()
+        server._cache_put("op://AI/netbox/credential", "cached-credential")
+        result = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(result["value"], "netbox-pass")
+        self.assertEqual(self.fake_client.secrets.calls, ["op://AI/netbox/password"])
+
+    async def test_resolve_secret_does_not_repeat_failed_hint(self):
+        server._remember_field("op://AI/netbox/", server._field_candidates("password"), "password")
+        self.fake_client.secrets.delays["password"] = 60
+        with mock.patch.object(server, "OP_RESOLVE_TIMEOUT", 0.05):
+            result = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(result["field"], "secret")
+        self.assertEqual(self.fake_client.secrets.calls.count("op://AI/netbox/password"), 1)
+
+    async def test_field_hints_evict_least_recently_used(self):
+        candidates = server._field_candidates("password")
+        with mock.patch.object(server, "OP_SECRET_CACHE_SIZE", 2):
+            server._remember_field("op://AI/a/", candidates, "password")
+            server._remember_field("op://AI/b/", candidates, "password")
+            self.assertEqual(server._hinted_field("op://AI/a/", candidates), "password")
+            server._remember_field("op://AI/c/", candidates, "password")
+        self.assertEqual(server._hinted_field("op://AI/a/", candidates), "password")
+        self.assertIsNone(server._hinted_field("op://AI/b/", candidates))
+
+    async def test_resolve_secret_caps_concurrent_lookups(self):
+        resolve = self.fake_client.secrets.resolve
+        in_flight = []
+        peak = []
+
+        async def tracked_resolve(path):
+            in_flight.append(path)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(path)
+            return await resolve(path)
+
+        self.fake_client.secrets.resolve = tracked_resolve
+        with mock.patch.object(server, "_resolve_semaphore", asyncio.Semaphore(2)):
+            result = await server.resolve_secret_impl("api", intent="secret", vault="Vault2", client=self.fake_client)
+        self.assertEqual(result["field"], "api_key")
+        self.assertEqual(max(peak), 2)
+
     async def test_resolve_secret_raises_for_missing_fields(self):
         with self.assertRaises(RuntimeError) as ctx:
             await server.resolve_secret_impl("missing-item", intent="password", vault="AI", client=self.fake_client)
         self.assertIn("Unable to resolve any fields", str(ctx.exception))
 
+    async def test_resolve_secret_caches_until_upsert(self):
+        await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.fake_client.secrets.values[("AI", "netbox", "password")] = "rotated-pass"
+
+        cached = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(cached["value"], "netbox-pass")
+
+        await server.upsert_item_impl(name="netbox", kind="password", fields={"password": "rotated-pass"}, vault="AI")
+        refreshed = await server.resolve_secret_impl("netbox", intent="password", vault="AI", client=self.fake_client)
+        self.assertEqual(refreshed["value"], "rotated-pass")
+
+    async def test_upsert_during_lookup_does_not_cache_old_value(self):
+        reference = "op://AI/netbox/password"
+        resolve = self.fake_client.secrets.resolve
+        read, release = asyncio.Event(), asyncio.Event()
+
+        async def gated_resolve(path):
+            # Only the lookup that read the pre-upsert value is held back.
+            value = await resolve(path)
+            if value == "old":
+                read.set()
+                await release.wait()
+            return value
+
+        async def gated_resolve_all(references):
+            values = [await gated_resolve(path) for path in references]
+            return SimpleNamespace(
+                individual_responses={
+                    path: SimpleNamespace(content=SimpleNamespace(secret=value), error=None)
+                    for path, value in zip(references, values)
+                }
+            )
+
+        for name, lookup in (
+            ("single", lambda: server._resolve_reference(self.fake_client, reference)),
+            ("batched", lambda: server._batched_resolve(self.fake_client, [reference])),
+        ):
+            with self.subTest(name):
+                self.fake_client.secrets.values[("AI", "netbox", "password")] = "old"
+                self.fake_client.secrets.resolve = gated_resolve
+                self.fake_client.secrets.resolve_all = gated_resolve_all if name == "batched" else None
+                server._secret_cache.clear()
+                read.clear()
+                release.clear()
+
+                pending = asyncio.ensure_future(lookup())
+                await read.wait()
+                self.fake_client.secrets.values[("AI", "netbox", "password")] = "new"
+                await server.upsert_item_impl(name="netbox", kind="password", fields={"password": "new"}, vault="AI")
+                # A reader arriving after the upsert runs its own lookup instead of joining the old one.
+                fresh = asyncio.ensure_future(server._resolve_reference(self.fake_client, reference))
+                done, _ = await asyncio.wait({fresh}, timeout=5)
+                self.assertIn(fresh, done)
+                self.assertEqual(fresh.result(), "new")
+
+                # The pre-upsert lookup finishing later must not put the old value back.
+                release.set()
+                await pending
+                self.assertEqual(await server._resolve_reference(self.fake_client, reference), "new")
+
+    async def test_vaults_resource_serves_stale_while_revalidating(self):
+        calls = []
+
+        def list_vaults():
+            calls.append(1)
+            return [SimpleNamespace(id=str(len(calls)), name=f"Vault{len(calls)}")]
+
+        self.fake_client.vaults = SimpleNamespace(list=list_vaults)
+        self.enterContext(mock.patch.object(server, "_client", self.fake_client))
+        first = await server.vaults_resource()
+        self.assertEqual(await server.vaults_resource(), first)
+        self.assertEqual(len(calls), 1)
+
+        # Past the fresh window: stale data is returned and a refresh runs in the background.
+        server._vaults_cache["cached_at"] -= server.VAULTS_FRESH_TTL + 1
+        self.assertEqual(await server.vaults_resource(), first)
+        await server._vaults_cache["refresh"]
+        self.assertEqual(await server.vaults_resource(), [{"id": "2", "name": "Vault2"}])
+        self.assertEqual(len(calls), 2)
+
     async def test_list_items_filters_by_query_and_vault(self):
         results = await server.list_items_impl(query="api", vault="Vault2", client=self.fake_client)
         self.assertEqual(len(results), 1)
-        self.assertEqual(results[0]["title"], "API Token")
-        self.assertEqual(results[0]["vault"], "Vault2")
+        self.assertEqual(results[0].title, "API Token")
+        self.assertEqual(results[0].vault, "Vault2")
+
+    async def test_list_items_awaits_async_sdk(self):
+        items_api = self.fake_client.items
+
+        async def list_async(**kwargs):
+            return items_api.list(**kwargs)
+
+        async_client = FakeClient({}, [])
+        async_client.items.list = list_async
+        results = await server.list_items_impl(vault="AI", client=async_client)
+        self.assertEqual([r.title for r in results], ["NetBox"])
 
     async def test_upsert_item_password_template(self):
         result = await server.upsert_item_impl(
@@ -122,22 +401,25 @@ class ServerTests(unittest.IsolatedAsyncioTestCase):
             vault="AI",
         )
         self.assertEqual(result["kind"], "ssh_key")
-        values = {f["id"]: f["value"] for f in result["fields"]}
-        self.assertEqual(values["private_key"], "PRIVATE")
-        self.assertEqual(values["public_key"], "PUBLIC")
-        self.assertEqual(values["passphrase"], "secret-pass")
+        self.assertEqual(
+            [(f["id"], f["value"]) for f in result["fields"]],
+            [("private_key", "PRIVATE"), ("public_key", "PUBLIC"), ("passphrase", "secret-pass")],
+        )
 
     async def test_run_with_secrets_injects_env_vars(self):
         """Verify secrets are injected as environment variables."""
+        runner = fake_runner(output=lambda env: env.get("DB_PASS", "NOT_SET").encode())
         result = await server.run_with_secrets_impl(
-            command=["python", "-c", "import os; print(os.environ.get('DB_PASS', 'NOT_SET'))"],
+            command=["show-env"],
             secrets=[{"item": "netbox", "intent": "password", "env": "DB_PASS"}],
             vault="AI",
             client=self.fake_client,
+            runner=runner,
         )
         self.assertEqual(result["exit_code"], 0)
         self.assertIn("netbox-pass", result["stdout"])
         self.assertEqual(result["secrets_injected"], ["DB_PASS"])
+        self.assertEqual(runner.calls[0]["command"], ["show-env"])
 
     async def test_run_with_secrets_does_not_leak_secrets_in_return(self):
         """Verify secrets are not in the return value (only env var names)."""
@@ -153,90 +435,268 @@ class ServerTests(unittest.IsolatedAsyncioTestCase):
         # But the env var name should be listed
         self.assertIn("SECRET_VAR", result["secrets_injected"])
 
+    async def test_run_with_secrets_truncates_large_output(self):
+        """Verify captured output is capped at the configured limit."""
+        result = await server.run_with_secrets_impl(
+            command=["chatty"],
+            secrets=[],
+            vault="AI",
+            stdout_limit=1024,
+            client=self.fake_client,
+            runner=fake_runner(output=lambda env: b"x" * 100000),
+        )
+        self.assertEqual(result["exit_code"], 0)
+        self.assertEqual(result["stdout"], "x" * 1024)
+        self.assertTrue(result["stdout_truncated"])
+        self.assertNotIn("stderr_truncated", result)
+
     async def test_run_with_secrets_timeout(self):
         """Verify timeout kills long-running processes."""
+        runner = fake_runner(runtime=60)
         result = await server.run_with_secrets_impl(
             command=["sleep", "10"],
             secrets=[],
             vault="AI",
-            timeout=1,
+            timeout=0.01,
             client=self.fake_client,
+            runner=runner,
         )
         self.assertEqual(result["exit_code"], -1)
         self.assertTrue(result.get("timed_out", False))
+        self.assertTrue(runner.process.killed)
 
     async def test_write_env_file_dotenv_format(self):
         """Test writing secrets in dotenv format."""
-        with tempfile.TemporaryDirectory() as tmpdir:
-            path = os.path.join(tmpdir, "secrets.env")
-            result = await server.write_env_file_impl(
-                path=path,
-                secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
-                vault="AI",
-                format="dotenv",
-                client=self.fake_client,
-            )
-            self.assertEqual(result["path"], path)
-            self.assertEqual(result["format"], "dotenv")
-            self.assertEqual(result["keys"], ["DB_PASS"])
-            self.assertEqual(result["permissions"], "0600")
+        path = os.path.join(self.tmpdir, "secrets.env")
+        result = await server.write_env_file_impl(
+            path=path,
+            secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
+            vault="AI",
+            format="dotenv",
+            client=self.fake_client,
+        )
+        self.assertEqual(result["path"], path)
+        self.assertEqual(result["format"], "dotenv")
+        self.assertEqual(result["keys"], ["DB_PASS"])
+        self.assertEqual(result["permissions"], "0600")
 
-            # Verify file content
-            with open(path) as f:
-                content = f.read()
-            self.assertIn('DB_PASS="netbox-pass"', content)
+        # Verify file content
+        with open(path) as f:
+            content = f.read()
+        self.assertIn('DB_PASS="netbox-pass"', content)
 
-            # Verify permissions (0600)
-            file_stat = os.stat(path)
-            self.assertEqual(stat.S_IMODE(file_stat.st_mode), 0o600)
+        # Verify permissions (0600)
+        file_stat = os.stat(path)
+        self.assertEqual(stat.S_IMODE(file_stat.st_mode), 0o600)
 
     async def test_write_env_file_export_format(self):
         """Test writing secrets in export format."""
-        with tempfile.TemporaryDirectory() as tmpdir:
-            path = os.path.join(tmpdir, "secrets.sh")
-            result = await server.write_env_file_impl(
-                path=path,
-                secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
-                vault="AI",
-                format="export",
-                client=self.fake_client,
-            )
-            with open(path) as f:
-                content = f.read()
-            self.assertIn('export DB_PASS="netbox-pass"', content)
+        path = os.path.join(self.tmpdir, "secrets.sh")
+        result = await server.write_env_file_impl(
+            path=path,
+            secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
+            vault="AI",
+            format="export",
+            client=self.fake_client,
+        )
+        with open(path) as f:
+            content = f.read()
+        self.assertIn('export DB_PASS="netbox-pass"', content)
+
+    async def test_write_env_file_export_escapes_shell_metacharacters(self):
+        """Verify a sourced export file yields the exact secret, with no shell expansion."""
+        path = os.path.join(self.tmpdir, "tricky.sh")
+        await server.write_env_file_impl(
+            path=path,
+            secrets=[{"item": "tricky", "intent": "password", "key": "TRICKY"}],
+            vault="AI",
+            format="export",
+            client=self.fake_client,
+        )
+        proc = await asyncio.create_subprocess_exec(
+            "sh", "-c", f'. "{path}" && printf %s "$TRICKY"', stdout=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await proc.communicate()
+        self.assertEqual(stdout.decode(), 'pa"ss $HOME `id` \\ end')
+
+    async def test_write_env_file_dotenv_escapes_quotes_backslashes_and_newlines(self):
+        """Verify a multi-line secret stays on one escaped dotenv line."""
+        path = os.path.join(self.tmpdir, "multiline.env")
+        await server.write_env_file_impl(
+            path=path,
+            secrets=[{"item": "multiline", "intent": "password", "key": "MULTI"}],
+            vault="AI",
+            client=self.fake_client,
+        )
+        with open(path, newline="") as f:
+            self.assertEqual(f.read(), 'MULTI="line1\\r\\n\\"quoted\\" \\\\ end"\n')
 
     async def test_write_env_file_json_format(self):
         """Test writing secrets in JSON format."""
-        with tempfile.TemporaryDirectory() as tmpdir:
-            path = os.path.join(tmpdir, "secrets.json")
+        path = os.path.join(self.tmpdir, "secrets.json")
+        result = await server.write_env_file_impl(
+            path=path,
+            secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
+            vault="AI",
+            format="json",
+            client=self.fake_client,
+        )
+        with open(path) as f:
+            content = f.read()
+        import json
+        data = json.loads(content)
+        self.assertEqual(data["DB_PASS"], "netbox-pass")
+
+    async def test_write_env_file_preserves_secret_order(self):
+        """Verify concurrently resolved secrets are written in spec order."""
+        path = os.path.join(self.tmpdir, "multi.env")
+        result = await server.write_env_file_impl(
+            path=path,
+            secrets=[
+                {"item": "netbox", "intent": "secret", "key": "NETBOX_SECRET"},
+                {"item": "netbox", "intent": "password", "key": "NETBOX_PASS"},
+            ],
+            vault="AI",
+            client=self.fake_client,
+        )
+        self.assertEqual(result["keys"], ["NETBOX_SECRET", "NETBOX_PASS"])
+        with open(path) as f:
+            content = f.read()
+        self.assertEqual(content.splitlines(), ['NETBOX_SECRET="netbox-secret"', 'NETBOX_PASS="netbox-pass"'])
+
+    async def test_write_env_file_batches_all_candidates(self):
+        """Verify every candidate field goes through one resolve_all call when the SDK offers it."""
+        batches = []
+
+        async def resolve_all(references):
+            batches.append(references)
+            responses = {}
+            for reference in references:
+                try:
+                    secret = await self.fake_client.secrets.resolve(reference)
+                    responses[reference] = SimpleNamespace(content=SimpleNamespace(secret=secret), error=None)
+                except KeyError:
+                    responses[reference] = SimpleNamespace(content=None, error=SimpleNamespace(type="fieldNotFound"))
+            return SimpleNamespace(individual_responses=responses)
+
+        self.fake_client.secrets.resolve_all = resolve_all
+        path = os.path.join(self.tmpdir, "batched.env")
+        await server.write_env_file_impl(
+            path=path,
+            secrets=[
+                {"item": "netbox", "intent": "password", "key": "DB_PASS"},
+                {"item": "netbox", "intent": "token", "key": "NETBOX_TOKEN"},
+            ],
+            vault="AI",
+            client=self.fake_client,
+        )
+        with open(path) as f:
+            content = f.read()
+        self.assertEqual(
+            batches,
+            [
+                [
+                    "op://AI/netbox/password",
+                    "op://AI/netbox/credential",
+                    "op://AI/netbox/secret",
+                    "op://AI/netbox/token",
+                    "op://AI/netbox/api_key",
+                    "op://AI/netbox/key",
+                ]
+            ],
+        )
+        self.assertEqual(content.splitlines(), ['DB_PASS="netbox-pass"', 'NETBOX_TOKEN="netbox-secret"'])
+
+    async def test_write_env_file_fails_fast_when_batch_tried_every_field(self):
+        """Verify a missing item is reported from the batch without per-field retries."""
+        batches = []
+
+        async def resolve_all(references):
+            batches.append(references)
+            error = SimpleNamespace(type="itemNotFound")
+            return SimpleNamespace(
+                individual_responses={reference: SimpleNamespace(content=None, error=error) for reference in references}
+            )
+
+        self.fake_client.secrets.resolve_all = resolve_all
+        with self.assertRaises(RuntimeError) as ctx:
+            await server.write_env_file_impl(
+                path=os.path.join(self.tmpdir, "missing.env"),
+                secrets=[{"item": "missing-item", "intent": "password", "key": "DB_PASS"}],
+                vault="AI",
+                client=self.fake_client,
+            )
+        self.assertIn("Unable to resolve any fields for item 'missing-item'", str(ctx.exception))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(self.fake_client.secrets.calls, [])
+
+    async def test_write_env_file_retries_only_untried_fields(self):
+        """Verify a spec whose batched field failed does not probe that field again."""
+        self.fake_client.secrets.delays["password"] = 60
+        with mock.patch.object(server, "OP_RESOLVE_TIMEOUT", 0.05):
             result = await server.write_env_file_impl(
-                path=path,
+                path=os.path.join(self.tmpdir, "untried.env"),
                 secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
                 vault="AI",
-                format="json",
                 client=self.fake_client,
             )
-            with open(path) as f:
-                content = f.read()
-            import json
-            data = json.loads(content)
-            self.assertEqual(data["DB_PASS"], "netbox-pass")
+        self.assertEqual(result["keys"], ["DB_PASS"])
+        self.assertEqual(self.fake_client.secrets.calls.count("op://AI/netbox/password"), 1)
+
+    async def test_write_env_file_falls_back_when_batch_fails(self):
+        """Verify a failed resolve_all call falls back to resolving each reference."""
+
+        async def resolve_all(references):
+            raise ConnectionError("batch endpoint unavailable")
+
+        self.fake_client.secrets.resolve_all = resolve_all
+        path = os.path.join(self.tmpdir, "batch-failed.env")
+        await server.write_env_file_impl(
+            path=path,
+            secrets=[{"item": "api", "intent": "token", "key": "API_TOKEN"}],
+            vault="Vault2",
+            client=self.fake_client,
+        )
+        with open(path) as f:
+            self.assertEqual(f.read(), 'API_TOKEN="api-token-123"\n')
+
+    async def test_write_all_resumes_after_short_writes(self):
+        """Verify _write_all finishes the file when the kernel accepts only a few bytes per call."""
+        real_write = os.write
+        parts = [b"FIRST=1\n", b"SECOND=22\n", b"", b"THIRD=333\n"]
+
+        def short_writev(fd, buffers):
+            return real_write(fd, b"".join(buffers)[:3])
+
+        def short_write(fd, data):
+            return real_write(fd, bytes(data[:3]))
+
+        # Gathered writes, then the os.write fallback used where writev is unavailable.
+        for name, patches in (("writev", {"writev": short_writev}), ("write", {"writev": None, "write": short_write})):
+            with self.subTest(name), mock.patch.multiple(os, **patches):
+                path = os.path.join(self.tmpdir, f"short-{name}.env")
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                try:
+                    server._write_all(fd, list(parts))
+                finally:
+                    os.close(fd)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"".join(parts))
 
     async def test_write_env_file_fails_if_exists(self):
         """Verify write_env_file fails if file already exists (security)."""
-        with tempfile.TemporaryDirectory() as tmpdir:
-            path = os.path.join(tmpdir, "existing.env")
-            # Create existing file
-            with open(path, "w") as f:
-                f.write("existing content")
-
-            with self.assertRaises(FileExistsError):
-                await server.write_env_file_impl(
-                    path=path,
-                    secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
-                    vault="AI",
-                    client=self.fake_client,
-                )
+        path = os.path.join(self.tmpdir, "existing.env")
+        # Create existing file
+        with open(path, "w") as f:
+            f.write("existing content")
+
+        with self.assertRaises(FileExistsError):
+            await server.write_env_file_impl(
+                path=path,
+                secrets=[{"item": "netbox", "intent": "password", "key": "DB_PASS"}],
+                vault="AI",
+                client=self.fake_client,
+            )
 
 
 if __name__ == "__main__":